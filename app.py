@@ -1,112 +1,364 @@
 import streamlit as st
 import re
 import os
+import mmap
 import hashlib
-from collections import defaultdict, Counter
-import difflib
+from collections import Counter
 import tempfile
+import functools
+import heapq
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from rapidfuzz.distance import Indel
+
+CPP_KEYWORDS = frozenset({
+    "auto", "break", "case", "char", "const", "continue",
+    "default", "do", "double", "else", "enum", "extern",
+    "float", "for", "goto", "if", "int", "long", "register",
+    "return", "short", "signed", "sizeof", "static", "struct",
+    "switch", "typedef", "union", "unsigned", "void", "volatile",
+    "while", "class", "namespace", "try", "catch", "new",
+    "delete", "public", "private", "protected", "template",
+    "virtual", "friend", "inline", "operator", "using", "throw",
+})
+
+# Integer token ids produced by the tokenizer: identifiers are numbered
+# 0, 1, 2, ... per file; keywords, literals and other characters are negative.
+# -1 is never used: hash(-1) == hash(-2) in CPython, which would make lines
+# such as "auto;" and "break;" hash alike.
+KEYWORD_IDS = {kw.encode(): -(i + 2) for i, kw in enumerate(sorted(CPP_KEYWORDS))}
+NUM_ID = -100
+STR_ID = -101
+CHAR_ID_BASE = -1000  # other characters map to CHAR_ID_BASE - ord(char)
+_NEWLINE_ID = CHAR_ID_BASE - ord('\n')
+_WHITESPACE_IDS = frozenset(CHAR_ID_BASE - char for char in b' \t\n\r\x0b\x0c')
+_TOKEN_NAMES = {token_id: kw.decode() for kw, token_id in KEYWORD_IDS.items()}
+_TOKEN_NAMES.update({NUM_ID: "NUM", STR_ID: "STR"})
+
+# Preprocessing patterns; all analysis runs on the raw (undecoded) bytes
+_RE_COMMENT = re.compile(rb'/\*.*?\*/|//[^\n]*', re.DOTALL)
+# A run of comments and whitespace; group 1 is set if the run has any whitespace
+_RE_COMMENT_WS = re.compile(rb'(?:/\*.*?\*/|//[^\n]*|(\s+))+', re.DOTALL)
+_RE_WS = re.compile(rb'\s+')
+_RE_OP_WS = re.compile(rb'\s*([=+\-*/(){}[\];<>!&|,.])\s*')
+# Token scanner: identifiers, numbers, string/char literals, other characters,
+# whitespace. The _NO_WS variant never matches whitespace, so finditer skips it in C.
+_TOKEN_PATTERN = rb"""([^\W\d]\w*)|(\d[\d.]*)|("(?:\\.|[^"\\])*["\\]?|'(?:\\.|[^'\\])*['\\]?)|(\S)"""
+_RE_TOKEN = re.compile(_TOKEN_PATTERN + rb'|(\s)', re.DOTALL)
+_RE_TOKEN_NO_WS = re.compile(_TOKEN_PATTERN, re.DOTALL)
+
+# Structure extraction patterns
+_RE_FUNC = re.compile(rb'\w+\s+(\w+)\s*\([^)]*\)\s*{[^}]*}')
+_RE_CLASS = re.compile(rb'class\s+(\w+)[^{]*{[^}]*}')
+_CTRL_KEYWORDS = (b'if', b'else', b'for', b'while', b'switch', b'case')
+_RE_WORD_CHAR = re.compile(rb'\w')
+_RE_CTRL = re.compile(rb'\b(?:' + b'|'.join(_CTRL_KEYWORDS) + rb')\b')
+
+def _as_bytes(code):
+    """Return code as bytes, encoding text input (e.g. pasted code) as UTF-8."""
+    return code.encode('utf-8', errors='ignore') if isinstance(code, str) else code
+
+def _content_digest(code):
+    """BLAKE2b digest identifying a code sample's content."""
+    return hashlib.blake2b(_as_bytes(code), digest_size=16).digest()
+
+def _word_ids(words):
+    """
+    Map words to stable signed 64-bit ids (BLAKE2b of the word), so MOSS
+    fingerprints do not depend on the per-process hash() randomization.
+    """
+    ids = {word: int.from_bytes(hashlib.blake2b(word, digest_size=8).digest(), 'little', signed=True)
+           for word in set(words)}
+    return tuple(map(ids.__getitem__, words))
+
+def _has_content(line):
+    """Whether a preprocessed line (bytes or token ids) has more than punctuation."""
+    if isinstance(line, bytes):
+        return _RE_WORD_CHAR.search(line) is not None
+    return any(token > CHAR_ID_BASE for token in line)
+
+def _line_hashes(lines):
+    """
+    Hash each preprocessed line to an int64, so line sequences compare as
+    flat integer arrays rather than as sequences of bytes/tuple objects.
+    
+    Returns:
+        (line_hashes, content_hashes): hashes of all lines, and of only the
+        lines with a word, number or literal in them
+    """
+    line_hashes = np.fromiter(map(hash, lines), dtype=np.int64, count=len(lines))
+    # Blank lines and lines of bare punctuation ({, }, ;) occur in any two
+    # files, so the line metric leaves them out
+    has_content = np.fromiter(map(_has_content, lines), dtype=bool, count=len(lines))
+    return line_hashes, line_hashes[has_content]
+
+def _tokenize_cpp_py(code, keyword_ids, keep_whitespace):
+    """
+    Tokenize C++ bytes into a list of integer token ids.
+    
+    Pure Python fallback for cpp_tokenizer.tokenize_cpp, with the same
+    signature and output. Whitespace tokens are included only when
+    keep_whitespace is true.
+    """
+    stream = []
+    identifier_map = {}
+    token_re = _RE_TOKEN if keep_whitespace else _RE_TOKEN_NO_WS
+    
+    for match in token_re.finditer(code):
+        kind = match.lastindex
+        
+        # Identifier or keyword
+        if kind == 1:
+            word = match.group()
+            token = keyword_ids.get(word)
+            if token is None:
+                # Normalize identifiers
+                token = identifier_map.setdefault(word, len(identifier_map))
+            stream.append(token)
+        
+        # Number literals
+        elif kind == 2:
+            stream.append(NUM_ID)
+        
+        # String literals
+        elif kind == 3:
+            stream.append(STR_ID)
+        
+        # Other characters (operators, brackets, etc.) and kept whitespace
+        else:
+            stream.append(CHAR_ID_BASE - ord(match.group()))
+    
+    return stream
+
+def _window_hashes(ids, k):
+    """
+    Polynomial hash of every window of k consecutive int64 ids.
+    
+    Uses uint64 (wrapping) arithmetic, built in k vectorized passes over the
+    id array. Ids are mostly small integers, so a large odd base is needed to
+    keep distinct windows from colliding.
+    """
+    base = np.uint64(0x9E3779B97F4A7C15)
+    ids = ids.view(np.uint64)
+    count = len(ids) - k + 1
+    hashes = np.zeros(count, dtype=np.uint64)
+    for offset in range(k):
+        hashes = hashes * base + ids[offset:offset + count]
+    return hashes.view(np.int64)
+
+def _greedy_string_tiling(seq1, seq2, min_length):
+    """
+    Greedy String Tiling, as used by JPlag.
+    
+    Repeatedly takes the longest common run of unmarked items and marks it
+    as a tile, so each item belongs to at most one tile and moved or
+    reordered blocks are still found. Every maximal run is found once up
+    front, by grouping matching windows of min_length items by diagonal; a
+    run that later overlaps a tile is split into its unmarked pieces instead
+    of rescanning both sequences.
+    
+    Like difflib's autojunk, windows that are very common in seq2 (more than
+    1% of it, for sequences of 200 or more items) never seed a run.
+    Otherwise a block of repeated lines, such as a data table, would give a
+    quadratic number of candidate pairs.
+    
+    Args:
+        seq1, seq2: int64 arrays, e.g. line hashes
+        min_length: Minimum tile length
+    
+    Returns:
+        List of (start1, start2, length) tiles with length >= min_length
+    """
+    n1, n2 = len(seq1), len(seq2)
+    window = max(min_length, 1)
+    if n1 < window or n2 < window:
+        return []
+    
+    # Index the windows of seq2 by hash, without the popular ones
+    hashes1 = _window_hashes(seq1, window)
+    hashes2 = _window_hashes(seq2, window)
+    order2 = np.argsort(hashes2, kind='stable')
+    sorted2 = hashes2[order2]
+    if n2 >= 200:
+        keys, counts = np.unique(sorted2, return_counts=True)
+        keep = ~np.isin(sorted2, keys[counts > n2 // 100 + 1])
+        order2, sorted2 = order2[keep], sorted2[keep]
+    
+    # Every pair (i, j) of windows with equal hashes, checked item by item
+    lo = np.searchsorted(sorted2, hashes1, side='left')
+    counts = np.searchsorted(sorted2, hashes1, side='right') - lo
+    starts1 = np.repeat(np.arange(len(hashes1)), counts)
+    offsets = np.arange(len(starts1)) - np.repeat(np.cumsum(counts) - counts, counts)
+    starts2 = order2[np.repeat(lo, counts) + offsets]
+    equal = (sliding_window_view(seq1, window)[starts1] ==
+             sliding_window_view(seq2, window)[starts2]).all(axis=1)
+    starts1, starts2 = starts1[equal], starts2[equal]
+    if not len(starts1):
+        return []
+    
+    # Matching windows at consecutive positions of one diagonal (j - i) make
+    # up a single maximal run
+    diagonals = starts2 - starts1
+    order = np.lexsort((starts1, diagonals))
+    starts1, diagonals = starts1[order], diagonals[order]
+    run_start = np.ones(len(starts1), dtype=bool)
+    run_start[1:] = (diagonals[1:] != diagonals[:-1]) | (starts1[1:] != starts1[:-1] + 1)
+    first = np.flatnonzero(run_start)
+    last = np.append(first[1:], len(starts1)) - 1
+    lengths = starts1[last] - starts1[first] + window
+    
+    # All maximal common runs, longest first (ties in sequence order)
+    runs = list(zip((-lengths).tolist(), starts1[first].tolist(),
+                    (starts1[first] + diagonals[first]).tolist()))
+    heapq.heapify(runs)
+    
+    marked1 = np.zeros(n1, dtype=bool)
+    marked2 = np.zeros(n2, dtype=bool)
+    tiles = []
+    
+    while runs:
+        neg_length, i, j = heapq.heappop(runs)
+        length = -neg_length
+        free = ~(marked1[i:i+length] | marked2[j:j+length])
+        
+        if free.all():
+            marked1[i:i+length] = True
+            marked2[j:j+length] = True
+            tiles.append((i, j, length))
+            continue
+        
+        # Overlaps an existing tile: requeue the unmarked pieces that are still long enough
+        edges = np.flatnonzero(np.diff(np.concatenate(([False], free, [False])))).tolist()
+        for piece_start, piece_end in zip(edges[::2], edges[1::2]):
+            if piece_end - piece_start >= min_length:
+                heapq.heappush(runs, (piece_start - piece_end, i + piece_start, j + piece_start))
+    
+    return tiles
+
+try:
+    # Optional compiled tokenizer, built with: python setup.py build_ext --inplace
+    from cpp_tokenizer import tokenize_cpp
+except ImportError:
+    tokenize_cpp = _tokenize_cpp_py
 
 class CPPSimilarityChecker:
     def __init__(self):
         self.ignore_comments = True
         self.ignore_whitespace = True
         self.normalize_identifiers = True
-        
-    def load_cpp_file(self, file_path):
-        """Load a C++ file from the given path."""
+        # check_batch scores a pair 0 without comparing it when the smaller
+        # file has fewer than this fraction of the larger file's tokens...
+        self.batch_min_size_ratio = 0.3
+        # ...or when their control structure counts differ by more than this
+        # fraction (L1 distance over the sum of per-keyword maxima), provided
+        # that sum is at least batch_min_control_count
+        self.batch_max_control_distance = 0.7
+        self.batch_min_control_count = 20
+        # Each input is preprocessed several times per comparison; memoize the
+        # most recent results keyed on the code and the active options.
+        self._preprocess_cached = functools.lru_cache(maxsize=8)(self._preprocess)
+        # Structure does not depend on the options, so it is keyed on the code alone
+        self._extract_structure_cached = functools.lru_cache(maxsize=8)(self._extract_structure)
+        
+    def _open_cpp_file(self, file_path):
+        """Open a C++ file for binary reading, raising FileNotFoundError if it is missing."""
         if not os.path.exists(file_path):
             raise FileNotFoundError(f"File {file_path} not found")
-            
-        with open(file_path, 'r', encoding='utf-8', errors='ignore') as file:
-            return file.read()
+        return open(file_path, 'rb')
+    
+    def load_cpp_file(self, file_path):
+        """Load a C++ file from the given path as raw bytes (no decoding)."""
+        with self._open_cpp_file(file_path) as file:
+            # mmap cannot map an empty file
+            if os.fstat(file.fileno()).st_size == 0:
+                return b''
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return mapped[:]
+    
+    def load_and_hash(self, file_path):
+        """
+        Load a C++ file as raw bytes, hashing it while it is read.
+        
+        Returns:
+            (data, digest): the file content and its content digest, suitable
+            for the digests argument of check_batch
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        data = bytearray()
+        with self._open_cpp_file(file_path) as file:
+            for chunk in iter(lambda: file.read(1 << 16), b''):
+                digest.update(chunk)
+                data.extend(chunk)
+        return bytes(data), digest.digest()
     
     def preprocess_cpp(self, code):
         """Preprocess C++ code by removing comments, normalizing whitespace, etc."""
-        # Remove C and C++ style comments
-        if self.ignore_comments:
-            # Remove C-style comments (/* */)
-            code = re.sub(r'/\*.*?\*/', '', code, flags=re.DOTALL)
-            # Remove C++-style comments (//)
-            code = re.sub(r'//.*?$', '', code, flags=re.MULTILINE)
-        
-        # Remove extra whitespace
-        if self.ignore_whitespace:
-            # Replace multiple whitespace with single space
-            code = re.sub(r'\s+', ' ', code)
-            # Remove whitespace around operators
-            code = re.sub(r'\s*([=+\-*/(){}[\];<>!&|,.])\s*', r'\1', code)
-        
-        # Normalize variable identifiers if requested
-        if self.normalize_identifiers:
-            # Extract tokens, preserving structure
-            tokens = []
-            current_token = ""
-            identifier_counter = 0
-            identifier_map = {}
-            
-            # Tokenize code
-            i = 0
-            while i < len(code):
-                char = code[i]
-                
-                # Identifier or keyword
-                if char.isalpha() or char == '_':
-                    start = i
-                    while i < len(code) and (code[i].isalnum() or code[i] == '_'):
-                        i += 1
-                    word = code[start:i]
-                    
-                    # Check if it's a C++ keyword
-                    cpp_keywords = {"auto", "break", "case", "char", "const", "continue", 
-                                   "default", "do", "double", "else", "enum", "extern", 
-                                   "float", "for", "goto", "if", "int", "long", "register", 
-                                   "return", "short", "signed", "sizeof", "static", "struct", 
-                                   "switch", "typedef", "union", "unsigned", "void", "volatile", 
-                                   "while", "class", "namespace", "try", "catch", "new", 
-                                   "delete", "public", "private", "protected", "template", 
-                                   "virtual", "friend", "inline", "operator", "using", "throw"}
-                    
-                    if word in cpp_keywords:
-                        tokens.append(word)
-                    else:
-                        # Normalize identifiers
-                        if word not in identifier_map:
-                            identifier_map[word] = f"VAR_{identifier_counter}"
-                            identifier_counter += 1
-                        tokens.append(identifier_map[word])
-                    continue
-                
-                # Number literals
-                elif char.isdigit():
-                    start = i
-                    while i < len(code) and (code[i].isdigit() or code[i] == '.'):
-                        i += 1
-                    tokens.append("NUM")
-                    continue
-                
-                # String literals
-                elif char == '"' or char == "'":
-                    quote = char
-                    start = i
-                    i += 1
-                    while i < len(code) and code[i] != quote:
-                        if code[i] == '\\' and i + 1 < len(code):
-                            i += 2
-                        else:
-                            i += 1
-                    if i < len(code):
-                        i += 1  # Skip closing quote
-                    tokens.append("STR")
-                    continue
-                
-                # Other characters (operators, brackets, etc.)
-                else:
-                    tokens.append(char)
-                    i += 1
-            
-            return ' '.join(tokens)
+        _, lines, _, _ = self._preprocessed(code)
+        if not self.normalize_identifiers:
+            return b'\n'.join(lines).decode('utf-8', errors='ignore')
+        
+        def token_text(token):
+            if token >= 0:
+                return f"VAR_{token}"
+            return _TOKEN_NAMES.get(token) or chr(CHAR_ID_BASE - token)
+        
+        return '\n'.join(' '.join(map(token_text, line)) for line in lines)
+    
+    def _preprocessed(self, code):
+        """
+        Preprocess code under the current options.
         
-        return code
+        Returns:
+            (tokens, lines, line_hashes, content_hashes): tokens is a tuple of
+            integer token ids with whitespace removed; lines is a tuple with
+            one entry per preprocessed line; line_hashes is an int64 array of
+            their hashes and content_hashes the same for only the lines that
+            are not blank or bare punctuation
+        """
+        return self._preprocess_cached(code, self.ignore_comments,
+                                       self.ignore_whitespace, self.normalize_identifiers)
+    
+    def _preprocess(self, code, ignore_comments, ignore_whitespace, normalize_identifiers):
+        """Uncached body of _preprocessed for the given options."""
+        code = _as_bytes(code)
+        
+        # The tokenizer drops whitespace itself, so whitespace only needs
+        # normalizing here when identifiers are left as they are
+        if ignore_whitespace and not normalize_identifiers:
+            if ignore_comments:
+                # Remove comments and replace each run of whitespace (and the
+                # comments inside it) with a single space, in one pass
+                code = _RE_COMMENT_WS.sub(lambda m: b'' if m.group(1) is None else b' ', code)
+            else:
+                # Replace multiple whitespace with single space
+                code = _RE_WS.sub(b' ', code)
+            # Remove whitespace around operators
+            code = _RE_OP_WS.sub(rb'\1', code)
+        elif ignore_comments:
+            # Remove C-style (/* */) and C++-style (//) comments
+            code = _RE_COMMENT.sub(b'', code)
+        
+        # Without normalization, tokens are the whitespace-separated words
+        if not normalize_identifiers:
+            lines = tuple(code.split(b'\n'))
+            return _word_ids(code.split()), lines, *_line_hashes(lines)
+        
+        # Extract tokens, preserving structure
+        stream = tokenize_cpp(code, KEYWORD_IDS, not ignore_whitespace)
+        if ignore_whitespace:
+            tokens = tuple(stream)
+            return tokens, (tokens,), *_line_hashes((tokens,))
+        
+        # Kept whitespace only distinguishes lines; drop it from the token stream
+        tokens = tuple(token for token in stream if token not in _WHITESPACE_IDS)
+        lines = []
+        start = 0
+        for i, token in enumerate(stream):
+            if token == _NEWLINE_ID:
+                lines.append(tuple(stream[start:i]))
+                start = i + 1
+        lines.append(tuple(stream[start:]))
+        return tokens, tuple(lines), *_line_hashes(lines)
     
     def calculate_moss_similarity(self, code1, code2, k=5, w=10):
         """
@@ -120,91 +372,82 @@ class CPPSimilarityChecker:
         Returns:
             Similarity score between 0 and 1
         """
-        # Get k-grams and their hashes for each code
-        def get_kgram_hashes(code, k):
-            tokens = code.split()
+        tokens1, _, _, _ = self._preprocessed(code1)
+        tokens2, _, _, _ = self._preprocessed(code2)
+        return self._moss_similarity(tokens1, tokens2, k, w)
+    
+    def _moss_similarity(self, tokens1, tokens2, k=5, w=10):
+        """MOSS similarity between two preprocessed token id sequences."""
+        # Get hashes and fingerprints for each code snippet
+        fingerprints1 = self._fingerprints(tokens1, k, w)
+        fingerprints2 = self._fingerprints(tokens2, k, w)
+        
+        return self._fingerprint_similarity(fingerprints1, fingerprints2)
+    
+    def _fingerprints(self, tokens, k=5, w=10):
+        """Winnowed MOSS fingerprints of a token id sequence, as a sorted unique array."""
+        # Get k-grams and their hashes
+        def get_kgram_hashes(tokens, k):
             if len(tokens) < k:
-                return []
-            
-            # Generate k-grams
-            kgrams = [' '.join(tokens[i:i+k]) for i in range(len(tokens)-k+1)]
-            
-            # Hash each k-gram
-            kgram_hashes = [int(hashlib.md5(kgram.encode()).hexdigest(), 16) for kgram in kgrams]
+                return np.empty(0, dtype=np.int64)
             
-            return kgram_hashes
+            # Hash every k-gram at once over the token id array
+            return _window_hashes(np.fromiter(tokens, dtype=np.int64, count=len(tokens)), k)
         
         # Apply winnowing algorithm to select fingerprints
         def winnow(hashes, w):
             if len(hashes) < w:
-                return hashes
-                
-            windows = [hashes[i:i+w] for i in range(len(hashes)-w+1)]
-            fingerprints = []
+                return np.unique(hashes)
             
-            for i, window in enumerate(windows):
-                # Find minimum hash in window and its position
-                min_hash = min(window)
-                min_pos = window.index(min_hash) + i
-                
-                # Add to fingerprints if not already added or at different position
-                if not fingerprints or fingerprints[-1][0] != min_hash:
-                    fingerprints.append((min_hash, min_pos))
-                    
-            # Extract just the hash values
-            return [h for h, pos in fingerprints]
-        
-        # Get preprocessed code
-        processed_code1 = self.preprocess_cpp(code1)
-        processed_code2 = self.preprocess_cpp(code2)
-        
-        # Get hashes and fingerprints for each code snippet
-        hashes1 = get_kgram_hashes(processed_code1, k)
-        hashes2 = get_kgram_hashes(processed_code2, k)
-        
-        # Apply winnowing to select fingerprints
-        fingerprints1 = set(winnow(hashes1, w))
-        fingerprints2 = set(winnow(hashes2, w))
+            # Minimum hash of every window of size w
+            window_mins = sliding_window_view(hashes, w).min(axis=1)
+            
+            # Keep a fingerprint only where the window minimum changed
+            changed = np.concatenate(([True], window_mins[1:] != window_mins[:-1]))
+            return np.unique(window_mins[changed])
         
-        # Calculate similarity
-        if not fingerprints1 or not fingerprints2:
+        return winnow(get_kgram_hashes(tokens, k), w)
+    
+    def _fingerprint_similarity(self, fingerprints1, fingerprints2):
+        """Jaccard similarity of two fingerprint arrays from _fingerprints."""
+        if not fingerprints1.size or not fingerprints2.size:
             return 0
             
-        intersection = fingerprints1.intersection(fingerprints2)
-        union = fingerprints1.union(fingerprints2)
-        similarity = len(intersection) / len(union)
+        # Fingerprints are already sorted and unique, so the intersection is a
+        # single merge and the union size follows from it
+        intersection = np.intersect1d(fingerprints1, fingerprints2, assume_unique=True).size
+        union = fingerprints1.size + fingerprints2.size - intersection
+        similarity = intersection / union
         
         return similarity
     
     def calculate_structure_similarity(self, code1, code2):
         """Calculate structural similarity between two code samples."""
-        # Helper to extract function/class structure
-        def extract_structure(code):
-            # Extract function declarations
-            function_pattern = r'\w+\s+(\w+)\s*\([^)]*\)\s*{[^}]*}'
-            functions = re.findall(function_pattern, code)
-            
-            # Extract class declarations
-            class_pattern = r'class\s+(\w+)[^{]*{[^}]*}'
-            classes = re.findall(class_pattern, code)
-            
-            # Extract control structures (simplified)
-            control_structures = []
-            for ctrl in ['if', 'else', 'for', 'while', 'switch', 'case']:
-                count = len(re.findall(rf'\b{ctrl}\b', code))
-                control_structures.append((ctrl, count))
-            
-            return {
-                'functions': Counter(functions),
-                'classes': Counter(classes),
-                'control_structures': dict(control_structures)
-            }
-        
         # Extract structure from both code samples
-        structure1 = extract_structure(code1)
-        structure2 = extract_structure(code2)
+        structure1 = self._extract_structure_cached(code1)
+        structure2 = self._extract_structure_cached(code2)
         
-        # Calculate similarity for functions and classes
+        return self._structure_similarity(structure1, structure2)
+    
+    def _extract_structure(self, code):
+        """Extract function/class structure and control structure counts."""
+        code = _as_bytes(code)
+        
+        # Each field counts its matches in a single scan; keywords that do
+        # not occur are simply absent from control_structures
+        return {
+            # Function declarations
+            'functions': Counter(_RE_FUNC.findall(code)),
+            # Class declarations
+            'classes': Counter(_RE_CLASS.findall(code)),
+            # Control structures (simplified)
+            'control_structures': Counter(_RE_CTRL.findall(code))
+        }
+    
+    def _structure_similarity(self, structure1, structure2):
+        """Structural similarity between two results of _extract_structure."""
+        # Multiset Jaccard similarity; for control structures this equals
+        # 1 - (L1 distance of the counts / sum of their per-keyword maxima)
         def count_similarity(counter1, counter2):
             if not counter1 and not counter2:
                 return 1.0
@@ -215,52 +458,44 @@ class CPPSimilarityChecker:
             total = sum((counter1 | counter2).values())
             return common / total if total > 0 else 0
         
-        # Calculate control structure similarity
-        def control_similarity(ctrl1, ctrl2):
-            all_keys = set(ctrl1.keys()) | set(ctrl2.keys())
-            if not all_keys:
-                return 1.0
-                
-            differences = 0
-            max_possible_diff = 0
-            
-            for key in all_keys:
-                val1 = ctrl1.get(key, 0)
-                val2 = ctrl2.get(key, 0)
-                max_val = max(val1, val2)
-                differences += abs(val1 - val2)
-                max_possible_diff += max_val
-            
-            return 1 - (differences / max_possible_diff if max_possible_diff > 0 else 0)
-        
         # Calculate individual similarities
         func_sim = count_similarity(structure1['functions'], structure2['functions'])
         class_sim = count_similarity(structure1['classes'], structure2['classes'])
-        ctrl_sim = control_similarity(structure1['control_structures'], structure2['control_structures'])
+        ctrl_sim = count_similarity(structure1['control_structures'], structure2['control_structures'])
         
         # Weighted average
         return 0.4 * func_sim + 0.3 * class_sim + 0.3 * ctrl_sim
     
     def calculate_line_similarity(self, code1, code2):
-        """Calculate line-by-line similarity using difflib."""
-        # Split code into lines
-        lines1 = self.preprocess_cpp(code1).split('\n')
-        lines2 = self.preprocess_cpp(code2).split('\n')
-        
-        # Use difflib to calculate similarity
-        matcher = difflib.SequenceMatcher(None, lines1, lines2)
-        return matcher.ratio()
+        """Calculate line-by-line similarity as a normalized LCS over the non-trivial lines."""
+        _, _, _, content1 = self._preprocessed(code1)
+        _, _, _, content2 = self._preprocessed(code2)
+        return self._line_similarity(content1, content2)
+    
+    def _line_similarity(self, lines1, lines2):
+        """Line similarity between two preprocessed line sequences."""
+        # Indel similarity is 2 * LCS / (len1 + len2), computed by rapidfuzz in C++
+        return Indel.normalized_similarity(lines1, lines2)
+    
+    def _weighted_similarity(self, moss_sim, structure_sim, line_sim):
+        """Combine the individual metrics into the overall similarity score."""
+        return 0.5 * moss_sim + 0.3 * structure_sim + 0.2 * line_sim
     
     def check_similarity(self, code1, code2):
-        """Check similarity between two C++ code strings."""
+        """Check similarity between two C++ code samples (str or bytes)."""
         try:
+            # Preprocess once; the metrics below work on the processed code
+            tokens1, _, lines1, content1 = self._preprocessed(code1)
+            tokens2, _, lines2, content2 = self._preprocessed(code2)
+            
             # Calculate similarities using different methods
-            moss_sim = self.calculate_moss_similarity(code1, code2)
+            moss_sim = self._moss_similarity(tokens1, tokens2)
             structure_sim = self.calculate_structure_similarity(code1, code2)
-            line_sim = self.calculate_line_similarity(code1, code2)
+            line_sim = self._line_similarity(content1, content2)
+            suspicious_segments = self._similar_segments(code1, code2, lines1, lines2)
             
             # Weight different metrics
-            overall_sim = 0.5 * moss_sim + 0.3 * structure_sim + 0.2 * line_sim
+            overall_sim = self._weighted_similarity(moss_sim, structure_sim, line_sim)
             
             # Determine similarity level
             if overall_sim >= 0.8:
@@ -274,9 +509,6 @@ class CPPSimilarityChecker:
             else:
                 similarity_level = "Very Low"
             
-            # Identify suspicious code segments
-            suspicious_segments = self.identify_similar_segments(code1, code2)
-            
             # Prepare report
             report = {
                 'summary': {
@@ -296,45 +528,111 @@ class CPPSimilarityChecker:
         except Exception as e:
             return {'error': str(e)}
     
+    def check_batch(self, codes, k=5, w=10, digests=None):
+        """
+        Calculate overall similarity between every pair of code snippets.
+        
+        Each distinct snippet is preprocessed, fingerprinted and structurally
+        analysed once, so only the pairwise comparisons scale with the number
+        of pairs. Identical snippets (e.g. duplicate submissions) are only
+        analysed once.
+        
+        Args:
+            codes: List of C++ code samples (str or bytes)
+            k: k-gram size
+            w: Window size for winnowing
+            digests: Optional content digests of codes, as returned by
+                load_and_hash; computed from codes when omitted
+        
+        Returns:
+            N x N array of overall similarity scores, weighted as in check_similarity;
+            pairs rejected by the size/control-structure pre-filter score 0
+        """
+        if digests is None:
+            digests = [_content_digest(code) for code in codes]
+        elif len(digests) != len(codes):
+            raise ValueError(f"Got {len(digests)} digests for {len(codes)} codes")
+        
+        # Map every input to the first input with the same content
+        unique_by_digest = {}
+        index = []
+        for code, digest in zip(codes, digests):
+            if digest not in unique_by_digest:
+                unique_by_digest[digest] = (len(unique_by_digest), code)
+            index.append(unique_by_digest[digest][0])
+        codes = [code for _, code in unique_by_digest.values()]
+        
+        # Per-file work, done once per distinct snippet
+        processed = [self._preprocessed(code) for code in codes]
+        fingerprints = [self._fingerprints(tokens, k, w) for tokens, _, _, _ in processed]
+        structures = [self._extract_structure_cached(code) for code in codes]
+        lines = [content_hashes for _, _, _, content_hashes in processed]
+        
+        n = len(codes)
+        similarity = np.zeros((n, n))
+        
+        # Cheap pre-filter: skip pairs whose sizes or control structure
+        # histograms are too far apart to be plausible copies
+        token_counts = np.array([len(tokens) for tokens, _, _, _ in processed], dtype=np.float64)
+        signatures = np.array([[structure['control_structures'][ctrl] for ctrl in _CTRL_KEYWORDS]
+                               for structure in structures], dtype=np.float64).reshape(n, len(_CTRL_KEYWORDS))
+        control_total = np.maximum(signatures[:, None], signatures[None, :]).sum(axis=2)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            size_ratio = np.minimum.outer(token_counts, token_counts) / np.maximum.outer(token_counts, token_counts)
+            control_distance = np.abs(signatures[:, None] - signatures[None, :]).sum(axis=2) / control_total
+        # Empty files give NaN here and are always compared; with only a few
+        # control structures, one added if would already exceed the distance
+        rejected = ((size_ratio < self.batch_min_size_ratio) |
+                    ((control_total >= self.batch_min_control_count) &
+                     (control_distance > self.batch_max_control_distance)))
+        
+        for j in range(n):
+            for i in range(j + 1):
+                if rejected[i, j]:
+                    continue
+                moss_sim = self._fingerprint_similarity(fingerprints[i], fingerprints[j])
+                structure_sim = self._structure_similarity(structures[i], structures[j])
+                line_sim = self._line_similarity(lines[i], lines[j])
+                similarity[i, j] = similarity[j, i] = self._weighted_similarity(
+                    moss_sim, structure_sim, line_sim)
+        
+        # Expand back to one row and column per input
+        return similarity[np.ix_(index, index)]
+    
     def identify_similar_segments(self, code1, code2, min_length=3):
         """Identify similar code segments between the two files."""
-        # Process code
-        processed1 = self.preprocess_cpp(code1)
-        processed2 = self.preprocess_cpp(code2)
-        
-        # Split into lines
-        lines1 = processed1.split('\n')
-        lines2 = processed2.split('\n')
+        _, _, lines1, _ = self._preprocessed(code1)
+        _, _, lines2, _ = self._preprocessed(code2)
+        return self._similar_segments(code1, code2, lines1, lines2, min_length)
+    
+    def _similar_segments(self, code1, code2, lines1, lines2, min_length=3):
+        """Similar segments of code1/code2 given their preprocessed line hashes."""
+        # Non-overlapping matching runs of at least min_length lines
+        matching_blocks = _greedy_string_tiling(lines1, lines2, min_length)
         
-        # Use difflib to find matching blocks
-        matcher = difflib.SequenceMatcher(None, lines1, lines2)
-        matching_blocks = matcher.get_matching_blocks()
+        # Original code lines, used to report the matching segments
+        original_lines1 = _as_bytes(code1).split(b'\n')
+        original_lines2 = _as_bytes(code2).split(b'\n')
         
         suspicious_segments = []
         
-        # Filter meaningful blocks (longer than min_length)
-        for block in matching_blocks:
-            i, j, size = block
-            if size >= min_length:
-                # Get original code segments
-                original_lines1 = code1.split('\n')
-                original_lines2 = code2.split('\n')
-                
-                # Ensure we don't go out of bounds
-                i_end = min(i + size, len(original_lines1))
-                j_end = min(j + size, len(original_lines2))
-                
-                segment1 = '\n'.join(original_lines1[i:i_end])
-                segment2 = '\n'.join(original_lines2[j:j_end])
-                
-                suspicious_segments.append({
-                    'file1_start_line': i + 1,  # 1-indexed for display
-                    'file2_start_line': j + 1,
-                    'length': size,
-                    'file1_segment': segment1,
-                    'file2_segment': segment2,
-                    'similarity': difflib.SequenceMatcher(None, segment1, segment2).ratio()
-                })
+        for i, j, size in matching_blocks:
+            # Ensure we don't go out of bounds
+            i_end = min(i + size, len(original_lines1))
+            j_end = min(j + size, len(original_lines2))
+            
+            # Only the reported segments are decoded to text
+            segment1 = b'\n'.join(original_lines1[i:i_end]).decode('utf-8', errors='ignore')
+            segment2 = b'\n'.join(original_lines2[j:j_end]).decode('utf-8', errors='ignore')
+            
+            suspicious_segments.append({
+                'file1_start_line': i + 1,  # 1-indexed for display
+                'file2_start_line': j + 1,
+                'length': size,
+                'file1_segment': segment1,
+                'file2_segment': segment2,
+                'similarity': Indel.normalized_similarity(segment1, segment2)
+            })
         
         # Sort by similarity (highest first)
         suspicious_segments.sort(key=lambda x: x['similarity'], reverse=True)
@@ -416,10 +714,8 @@ def main():
                 temp_file2 = save_uploaded_file(file2)
                 
                 # Load code from temp files
-                with open(temp_file1, 'r', encoding='utf-8', errors='ignore') as f:
-                    code1_content = f.read()
-                with open(temp_file2, 'r', encoding='utf-8', errors='ignore') as f:
-                    code2_content = f.read()
+                code1_content = checker.load_cpp_file(temp_file1)
+                code2_content = checker.load_cpp_file(temp_file2)
                     
                 # Clean up temp files
                 os.unlink(temp_file1)
@@ -0,0 +1,99 @@
+# cython: language_level=3, boundscheck=False, wraparound=False
+"""
+Compiled C++ tokenizer used by app.py when available.
+
+Mirrors app._tokenize_cpp_py (the regex-based fallback) token for token:
+a single pass over the byte buffer classifies identifiers, numbers,
+string/char literals, other characters and, optionally, whitespace.
+
+Build in place with: python setup.py build_ext --inplace
+"""
+from cpython.bytes cimport PyBytes_FromStringAndSize
+
+# Token id scheme; must match NUM_ID, STR_ID and CHAR_ID_BASE in app.py
+cdef long NUM_ID = -100
+cdef long STR_ID = -101
+cdef long CHAR_ID_BASE = -1000
+
+
+cdef inline bint is_ident_start(unsigned char c):
+    return (c >= b'a' and c <= b'z') or (c >= b'A' and c <= b'Z') or c == b'_'
+
+
+cdef inline bint is_digit(unsigned char c):
+    return c >= b'0' and c <= b'9'
+
+
+cdef inline bint is_space(unsigned char c):
+    # Same set as the \s class of a bytes regex
+    return c == b' ' or (c >= b'\t' and c <= b'\r')
+
+
+cpdef list tokenize_cpp(const unsigned char[::1] buf, dict keyword_ids, bint keep_whitespace):
+    """
+    Tokenize C++ bytes into a list of integer token ids.
+
+    Identifiers are numbered 0, 1, 2, ... in order of first appearance,
+    keywords map through keyword_ids, and literals and other characters get
+    fixed negative ids. Whitespace tokens are included only when
+    keep_whitespace is true.
+    """
+    cdef Py_ssize_t n = buf.shape[0]
+    cdef Py_ssize_t i = 0
+    cdef Py_ssize_t start
+    cdef unsigned char c, quote
+    cdef list stream = []
+    cdef dict identifier_map = {}
+    cdef bytes word
+    cdef object token
+
+    while i < n:
+        c = buf[i]
+
+        # Identifier or keyword
+        if is_ident_start(c):
+            start = i
+            i += 1
+            while i < n and (is_ident_start(buf[i]) or is_digit(buf[i])):
+                i += 1
+            word = PyBytes_FromStringAndSize(<const char*>&buf[start], i - start)
+            token = keyword_ids.get(word)
+            if token is None:
+                # Normalize identifiers
+                token = identifier_map.setdefault(word, len(identifier_map))
+            stream.append(token)
+
+        # Number literals
+        elif is_digit(c):
+            i += 1
+            while i < n and (is_digit(buf[i]) or buf[i] == b'.'):
+                i += 1
+            stream.append(NUM_ID)
+
+        # String literals; an unterminated literal runs to the end of the input
+        elif c == b'"' or c == b"'":
+            quote = c
+            i += 1
+            while i < n:
+                c = buf[i]
+                if c == b'\\':
+                    i += 2 if i + 1 < n else 1
+                elif c == quote:
+                    i += 1
+                    break
+                else:
+                    i += 1
+            stream.append(STR_ID)
+
+        # Whitespace
+        elif is_space(c):
+            if keep_whitespace:
+                stream.append(CHAR_ID_BASE - c)
+            i += 1
+
+        # Other characters (operators, brackets, etc.)
+        else:
+            stream.append(CHAR_ID_BASE - c)
+            i += 1
+
+    return stream
@@ -0,0 +1,15 @@
+"""
+Builds the optional compiled tokenizer used by app.py.
+
+    pip install cython
+    python setup.py build_ext --inplace
+
+app.py falls back to its regex tokenizer when the extension is not built.
+"""
+from setuptools import setup
+from Cython.Build import cythonize
+
+setup(
+    name="cpp-tokenizer",
+    ext_modules=cythonize("cpp_tokenizer.pyx"),
+)